@@ -1,26 +1,279 @@
+import hashlib
 import json
 import sys
-import re
 import pandas as pd
+import matplotlib
+matplotlib.use('Agg')  # non-interactive backend; we only ever save to PNG
 import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
+from matplotlib.lines import Line2D
 import numpy as np
 import os
+from concurrent.futures import ProcessPoolExecutor
 
-def parse_json_log_file(filename):
+# orjson is optional; it parses the short NDJSON records several times faster
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+# A Parquet engine is optional too; without one the combined log is just never cached
+try:
+    import pyarrow
+    _PARQUET_ENGINE = 'pyarrow'
+except ImportError:
+    _PARQUET_ENGINE = None
+
+# numba is optional as well; with it the per-machine summary is one compiled pass over the arrays
+try:
+    from numba import njit
+    _HAVE_NUMBA = True
+except ImportError:
+    _HAVE_NUMBA = False
+
+# Cache of the combined log, written next to the analysis outputs
+COMBINED_CACHE_FILE = "_combined.parquet"
+COMBINED_META_FILE = "_combined.meta.json"
+# Part of the cache fingerprint; bump it whenever combine_log_files or NUMERIC_DTYPES
+# changes the combined frame, so caches written by older code are rebuilt
+COMBINED_CACHE_VERSION = 1
+
+# Numeric event fields; each appears only on some event types, so they are float with NaN for "absent"
+NUMERIC_DTYPES = {
+    'old_clock': 'float64',
+    'new_clock': 'float64',
+    'queue_len': 'float64',
+    'final_clock': 'float64',
+    'clock_rate': 'float64',
+}
+
+# Resolution of the saved figure; pinned so output size doesn't depend on the user's matplotlibrc
+PLOT_DPI = 100
+
+# Clock/jump traces longer than this are decimated before plotting; the figure is only ~1500px wide
+MAX_PLOT_POINTS = 2000
+
+# Max number of raw records decoded before they are packed into a DataFrame
+LOG_CHUNK_SIZE = 50_000
+
+def iter_json_log_chunks(filename, chunksize=LOG_CHUNK_SIZE):
     """
-    Returns a DataFrame of all events in the given JSON log file.
-    Each row has keys like: event, system_time, machine_id, old_clock, new_clock, queue_len, etc.
+    Yields DataFrames of at most `chunksize` events from the given JSON log file.
+    pandas reads and parses the file one chunk at a time in C. If it rejects a chunk
+    (e.g. a line cut short when a machine was killed mid-write), the rest of the file
+    is read line by line instead, skipping lines that don't decode.
+    """
+    done = 0
+    try:
+        with pd.read_json(filename, lines=True, chunksize=chunksize, convert_dates=False, dtype=False) as reader:
+            for chunk in reader:
+                done += len(chunk)
+                yield chunk
+    except ValueError:
+        yield from iter_json_log_chunks_fallback(filename, chunksize, skip=done)
+
+def iter_json_log_chunks_fallback(filename, chunksize=LOG_CHUNK_SIZE, skip=0):
+    """
+    Line-by-line version of iter_json_log_chunks, starting after the first `skip` events.
+    Only one chunk of raw dicts is alive at a time.
     """
     rows = []
-    with open(filename, 'r') as f:
+    with open(filename, 'rb') as f:
         for line in f:
-            line = line.strip()
-            if not line:
+            if not line.strip():
+                continue
+            if skip:
+                skip -= 1
                 continue
-            record = json.loads(line)
-            record['log_file'] = filename
-            rows.append(record)
-    return pd.DataFrame(rows)
+            try:
+                rows.append(_json_loads(line))
+            except ValueError:
+                continue
+            if len(rows) >= chunksize:
+                yield pd.DataFrame(rows)
+                rows = []
+    if rows:
+        yield pd.DataFrame(rows)
+
+def parse_json_log_file(filename):
+    """
+    Returns a DataFrame of all events in the given JSON log file.
+    Each row has keys like: event, system_time, machine_id, old_clock, new_clock, queue_len, etc.
+    """
+    chunks = list(iter_json_log_chunks(filename))
+    df = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+    df['log_file'] = filename
+    return df
+
+def parse_json_log_files(log_files):
+    """
+    Returns one DataFrame per log file, in the same order as `log_files`.
+    Several files are parsed in worker processes, since JSON decoding holds the GIL.
+    """
+    if len(log_files) < 2:
+        return [parse_json_log_file(logf) for logf in log_files]
+    with ProcessPoolExecutor(max_workers=min(len(log_files), os.cpu_count() or 1)) as ex:
+        return list(ex.map(parse_json_log_file, log_files))
+
+def combine_log_files(log_files):
+    """
+    Returns the events of all `log_files` in one DataFrame, sorted by system_time,
+    with the numeric columns cast to NUMERIC_DTYPES.
+    """
+    data = pd.concat(parse_json_log_files(log_files), ignore_index=True)
+    # Each file is already in time order; a stable sort (timsort for floats) merges those runs cheaply
+    data = data.sort_values(by='system_time', kind='mergesort')
+    # recipients isn't used by the analysis, and its mixed [host, port] lists can't be stored in Parquet
+    data = data.drop(columns=['recipients'], errors='ignore')
+
+    # The JSON decoder already produced numbers, so a single cast is enough
+    return data.astype({col: dtype for col, dtype in NUMERIC_DTYPES.items() if col in data.columns})
+
+def log_files_fingerprint(log_files):
+    """
+    Returns an md5 hex digest of COMBINED_CACHE_VERSION and the sorted (path, mtime, size) of each log file.
+    """
+    stats = []
+    for logf in log_files:
+        st = os.stat(logf)
+        stats.append((os.path.abspath(logf), st.st_mtime_ns, st.st_size))
+    payload = [COMBINED_CACHE_VERSION, sorted(stats)]
+    return hashlib.md5(json.dumps(payload).encode('utf-8')).hexdigest()
+
+def load_combined_log(log_files, out_dir):
+    """
+    Returns combine_log_files(log_files), reusing the Parquet copy cached in `out_dir`
+    when none of the log files changed since it was written. Caching is best effort.
+    """
+    if _PARQUET_ENGINE is None:
+        return combine_log_files(log_files)
+
+    cache_path = os.path.join(out_dir, COMBINED_CACHE_FILE)
+    meta_path = os.path.join(out_dir, COMBINED_META_FILE)
+    fingerprint = log_files_fingerprint(log_files)
+
+    try:
+        with open(meta_path, "r") as f:
+            cached_fingerprint = json.load(f).get("fingerprint")
+    except (OSError, ValueError):
+        cached_fingerprint = None
+    if cached_fingerprint == fingerprint:
+        try:
+            return pd.read_parquet(cache_path, engine=_PARQUET_ENGINE)
+        except (OSError, ValueError):
+            pass
+
+    data = combine_log_files(log_files)
+    try:
+        data.to_parquet(cache_path, engine=_PARQUET_ENGINE, compression='zstd')
+        with open(meta_path, "w") as f:
+            json.dump({"fingerprint": fingerprint}, f)
+    except (OSError, ValueError, TypeError):
+        pass
+    return data
+
+def decimate_trace(points, max_points=MAX_PLOT_POINTS):
+    """
+    Returns `points`, an (n, 2) array of (x, y) rows sorted by x, reduced to at most about `max_points` rows.
+    Consecutive rows are bucketed and each bucket keeps its min and max y, so spikes survive.
+    """
+    n = len(points)
+    if n <= max_points:
+        return points
+    buckets = max(1, max_points // 2)
+    size = -(-n // buckets)  # ceil(n / buckets)
+    y = np.concatenate([points[:, 1], np.full(size * buckets - n, points[-1, 1])]).reshape(buckets, size)
+    starts = np.arange(buckets) * size
+    keep = np.concatenate([starts + y.argmin(axis=1), starts + y.argmax(axis=1), [0, n - 1]])
+    return points[np.unique(np.minimum(keep, n - 1))]
+
+def least_crowded_corner(ax, segments, box=(0.25, 0.3)):
+    """
+    Returns the legend `loc` (a corner of `ax`) whose `box`-sized area, in axes fractions,
+    holds the fewest points of `segments`. Legend loc='best' only avoids Line2D data,
+    not LineCollection segments, so the traces drawn as collections need this instead.
+    Ties go to the corners in the order loc='best' tries them.
+    """
+    (x0, x1), (y0, y1) = ax.get_xlim(), ax.get_ylim()
+    points = np.concatenate(segments) if segments else np.empty((0, 2))
+    fx = (points[:, 0] - x0) / ((x1 - x0) or 1)
+    fy = (points[:, 1] - y0) / ((y1 - y0) or 1)
+    bw, bh = box
+    corners = {
+        'upper right': (fx >= 1 - bw) & (fy >= 1 - bh),
+        'upper left': (fx <= bw) & (fy >= 1 - bh),
+        'lower left': (fx <= bw) & (fy <= bh),
+        'lower right': (fx >= 1 - bw) & (fy <= bh),
+    }
+    return min(corners, key=lambda loc: np.count_nonzero(corners[loc]))
+
+def _summarize_machines(codes, jumps, recv_queue_len, n_machines):
+    # One pass over the events: per machine code, the sum and count of non-NaN jumps
+    # and the max non-NaN RECEIVE queue length (NaN if there is none)
+    jump_sum = np.zeros(n_machines)
+    jump_count = np.zeros(n_machines, dtype=np.int64)
+    max_q = np.full(n_machines, np.nan)
+    for i in range(len(codes)):
+        m = codes[i]
+        if m < 0:
+            continue
+        j = jumps[i]
+        if not np.isnan(j):
+            jump_sum[m] += j
+            jump_count[m] += 1
+        q = recv_queue_len[i]
+        if not np.isnan(q) and (np.isnan(max_q[m]) or q > max_q[m]):
+            max_q[m] = q
+    return jump_sum, jump_count, max_q
+
+if _HAVE_NUMBA:
+    _summarize_machines = njit(cache=True, nogil=True)(_summarize_machines)
+
+def aggregate_per_machine(data):
+    """
+    Returns a DataFrame indexed by machine_id with each machine's avg_jump_size
+    (mean clock_jump) and max_queue_len (max queue_len over its RECEIVE events).
+    Uses the numba kernel when numba is installed, otherwise a single pandas groupby pass.
+    """
+    # queue length is only valid for RECEIVE events, so other rows are masked out
+    recv_queue_len = pd.Series(np.nan, index=data.index)
+    if 'queue_len' in data.columns:
+        recv_queue_len = data['queue_len'].where(data['is_recv'])
+
+    if not _HAVE_NUMBA:
+        per_event = pd.DataFrame({
+            'machine_id': data['machine_id'],
+            'jump': data['clock_jump'],
+            'recv_queue_len': recv_queue_len,
+        })
+        return per_event.groupby('machine_id').agg(
+            avg_jump_size=('jump', 'mean'),
+            max_queue_len=('recv_queue_len', 'max'),
+        )
+
+    codes, machine_ids = pd.factorize(data['machine_id'], sort=True)
+    jump_sum, jump_count, max_q = _summarize_machines(
+        codes,
+        data['clock_jump'].to_numpy(dtype=np.float64),
+        recv_queue_len.to_numpy(dtype=np.float64),
+        len(machine_ids),
+    )
+    with np.errstate(invalid='ignore', divide='ignore'):
+        avg_jump = np.where(jump_count > 0, jump_sum / jump_count, np.nan)
+    return pd.DataFrame(
+        {'avg_jump_size': avg_jump, 'max_queue_len': max_q},
+        index=pd.Index(machine_ids, name='machine_id'),
+    )
+
+def first_event_value(data, event, column):
+    """
+    Returns a Series indexed by machine_id holding `column` from each machine's first `event` row.
+    """
+    if column not in data.columns:
+        return pd.Series(dtype=float)
+    rows = data[data['event'] == event]
+    return rows.groupby('machine_id')[column].first()
 
 def main():
     if len(sys.argv) < 2:
@@ -37,81 +290,31 @@ def main():
     if not out_dir:
         out_dir = os.getcwd()  # fallback to current dir
     
-    all_dfs = []
-    for logf in log_files:
-        df = parse_json_log_file(logf)
-        all_dfs.append(df)
-    
-    data = pd.concat(all_dfs, ignore_index=True)
-    data = data.sort_values(by='system_time')
+    data = load_combined_log(log_files, out_dir)
+
+    # jump is (new_clock - old_clock) for SEND, RECEIVE, INTERNAL; NaN for rows lacking either clock
+    # The NaN mask is taken once here and reused by the summary and the plots
+    data['clock_jump'] = data['new_clock'].to_numpy() - data['old_clock'].to_numpy()
+    data['has_jump'] = ~np.isnan(data['clock_jump'].to_numpy())
+    data['is_recv'] = data['event'].to_numpy() == 'RECEIVE'
 
-    for col in ['old_clock', 'new_clock', 'queue_len', 'final_clock', 'clock_rate']:
-        if col in data.columns:
-            data[col] = pd.to_numeric(data[col], errors='coerce')
-    
     ### Summaries: clock_rate, final drift, average jump, max queue length ##
 
-    # Gather STARTUP events for each machine
-    startup_df = data[data['event'] == 'STARTUP'].copy()
-
-    # Gather END events for each machine (final_clock)
-    end_df = data[data['event'] == 'END'].copy()
-
-    # For each machine, we can find the final_clock from the END event
-    summary_rows = []
-
-    # Identify unique machines
-    machines = data['machine_id'].dropna().unique()
-    machines = sorted(machines)
-
-    # Store final clocks to compute drift
-    final_clocks = []
-
-    for m_id in machines:
-        # clock rate
-        rate = None
-        # final clock
-        fclock = None
-
-        # startup row
-        srow = startup_df[startup_df['machine_id'] == m_id]
-        if not srow.empty and 'clock_rate' in srow.columns:
-            rate = srow['clock_rate'].iloc[0]
-
-        # end row
-        erow = end_df[end_df['machine_id'] == m_id]
-        if not erow.empty and 'final_clock' in erow.columns:
-            fclock = erow['final_clock'].iloc[0]
-            final_clocks.append(fclock)
-
-        # average jump size
-        # we define jump as (new_clock - old_clock) for SEND, RECEIVE, INTERNAL
-        # ignoring rows that lack old_clock/new_clock
-        events_m = data[(data['machine_id'] == m_id) & 
-                        (data['old_clock'].notna()) & 
-                        (data['new_clock'].notna())]
-        jumps = events_m['new_clock'] - events_m['old_clock']
-        avg_jump = jumps.mean() if not jumps.empty else np.nan
-
-        # max queue length
-        # only valid for RECEIVE events
-        rec_m = data[(data['machine_id'] == m_id) & (data['event'] == 'RECEIVE')]
-        max_q = rec_m['queue_len'].max() if not rec_m.empty else 0
-
-        summary_rows.append({
-            "machine_id": m_id,
-            "clock_rate": rate,
-            "final_clock": fclock,
-            "avg_jump_size": avg_jump,
-            "max_queue_len": max_q
-        })
+    agg = aggregate_per_machine(data)
 
-    summary_df = pd.DataFrame(summary_rows)
+    # clock rate comes from the STARTUP event, final clock from the END event
+    summary_df = pd.DataFrame({
+        "machine_id": agg.index,
+        "clock_rate": first_event_value(data, 'STARTUP', 'clock_rate').reindex(agg.index).to_numpy(),
+        "final_clock": first_event_value(data, 'END', 'final_clock').reindex(agg.index).to_numpy(),
+        "avg_jump_size": agg['avg_jump_size'].to_numpy(),
+        "max_queue_len": agg['max_queue_len'].fillna(0).to_numpy(),
+    })
 
     # compute final drift = max final clock - min final clock
-    drift = None
+    final_clocks = summary_df['final_clock'].dropna()
     if len(final_clocks) > 1:
-        drift = max(final_clocks) - min(final_clocks)
+        drift = final_clocks.max() - final_clocks.min()
     else:
         drift = 0
 
@@ -122,40 +325,52 @@ def main():
 
     fig, axes = plt.subplots(1, 3, figsize=(15, 5), sharex=False)
 
-    ax1 = axes[0]
-    for m_id, grp in data.groupby('machine_id'):
-        # skip if no new_clock
-        if 'new_clock' not in grp.columns:
-            continue
-        ax1.plot(grp['system_time'], grp['new_clock'], label=f"M{int(m_id)}")
+    ax1, ax2, ax3 = axes
+
+    # One groupby feeds all three subplots
+    # Clock and jump traces are gathered into one LineCollection per subplot instead of a Line2D per machine
+    cycle = plt.rcParams['axes.prop_cycle'].by_key()['color']
+    colors, labels, clock_segments, jump_segments = [], [], [], []
+    for i, (m_id, grp) in enumerate(data.groupby('machine_id', sort=True)):
+        color = cycle[i % len(cycle)]
+        label = f"M{int(m_id)}"
+        colors.append(color)
+        labels.append(label)
+
+        # We only consider rows with old_clock/new_clock (STARTUP and END carry neither)
+        valid = grp[grp['has_jump'].to_numpy()]
+        times = valid['system_time'].to_numpy()
+        clock_segments.append(decimate_trace(np.column_stack([times, valid['new_clock'].to_numpy()])))
+        jump_segments.append(decimate_trace(np.column_stack([times, valid['clock_jump'].to_numpy()])))
+
+        recv = grp[grp['is_recv'].to_numpy()]
+        if not recv.empty:
+            ax2.plot(recv['system_time'].to_numpy(), recv['queue_len'].to_numpy(),
+                     marker='o', linestyle='-', color=color, label=label, rasterized=True)
+
+    handles = [Line2D([], [], color=c, label=l) for c, l in zip(colors, labels)]
+    for ax, segments in ((ax1, clock_segments), (ax3, jump_segments)):
+        ax.add_collection(LineCollection(segments, colors=colors, rasterized=True))
+        ax.autoscale()
+
     ax1.set_title("Lamport Clock vs. Time")
     ax1.set_xlabel("System Time (s)")
     ax1.set_ylabel("Lamport Clock")
-    ax1.legend()
+    ax1.legend(handles=handles, loc=least_crowded_corner(ax1, clock_segments))
 
-    ax2 = axes[1]
-    receives = data[data['event'] == 'RECEIVE'].copy()
-    for m_id, grp in receives.groupby('machine_id'):
-        ax2.plot(grp['system_time'], grp['queue_len'], marker='o', linestyle='-', label=f"M{int(m_id)}")
     ax2.set_title("Queue Length (RECEIVE)")
     ax2.set_xlabel("System Time (s)")
     ax2.set_ylabel("Queue Len")
     ax2.legend()
 
-    ax3 = axes[2]
-    data['clock_jump'] = data['new_clock'] - data['old_clock']
-    # We only consider rows with old_clock/new_clock
-    for m_id, grp in data.groupby('machine_id'):
-        valid = grp[grp['clock_jump'].notna()]
-        ax3.plot(valid['system_time'], valid['clock_jump'], label=f"M{int(m_id)}")
     ax3.set_title("Clock Jump vs. Time")
     ax3.set_xlabel("System Time (s)")
     ax3.set_ylabel("Jump (new_clock - old_clock)")
-    ax3.legend()
+    ax3.legend(handles=handles, loc=least_crowded_corner(ax3, jump_segments))
 
     plt.tight_layout()
     fig_path = os.path.join(out_dir, "analysis_subplots.png")
-    plt.savefig(fig_path)
+    plt.savefig(fig_path, dpi=PLOT_DPI)
     plt.close(fig)
 
     md_path = os.path.join(out_dir, "analysis_summary.md")
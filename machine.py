@@ -30,14 +30,24 @@ import threading
 import time
 import random
 import queue
+import selectors
 import argparse
 import sys
 
+# Buffered log lines are written out once this many events are pending...
+LOG_FLUSH_EVENTS = 256
+# ...or at least this often (seconds), whichever comes first
+LOG_FLUSH_INTERVAL = 1.0
+
+# handle_no_message draws 1..10; the draws are generated this many at a time
+EVENT_DRAW_BATCH = 1024
+
 class Machine:
     def __init__(self, machine_id, listen_port, peer_addresses, log_filename, run_seconds=60):
         """
         :param machine_id: int - The ID of this machine (e.g. 1, 2, 3).
-        :param listen_port: int - The TCP port on which this machine will listen for incoming connections.
+        :param listen_port: int - The TCP port on which this machine will listen for incoming connections,
+                            or None to not listen at all (no server socket, no listener thread).
         :param peer_addresses: list of (host, port) tuples for the other machines in the system.
         :param log_filename: str - The path to the log file for this machine.
         :param run_seconds: int - How long this machine will run before shutting down.
@@ -54,21 +64,41 @@ class Machine:
         # Lamport logical clock
         self.local_clock = 0
 
-        # Queue for incoming messages (timestamps)
-        self.incoming_queue = queue.Queue()
+        # Pre-generated random draws for handle_no_message, refilled by draw_event_choice
+        self._event_draws = iter(())
+
+        # Queue for incoming messages (timestamps); SimpleQueue's empty()/qsize() don't take a lock
+        self.incoming_queue = queue.SimpleQueue()
+
+        # Log file; events are encoded into an in-memory buffer and written out in batches
+        self.log_file = open(self.log_filename, "wb")
+        self._log_buf = bytearray()
+        self._log_pending = 0
+        self._log_lock = threading.Lock()
 
-        # Log file (line-buffered so you see output in real time)
-        self.log_file = open(self.log_filename, "w", buffering=1)
+        # Pre-encoded JSON fragments for the hand-rolled RECEIVE/SEND/INTERNAL log lines
+        self._machine_id_json = json.dumps(self.machine_id)
+        self._recipients_json = {}
+
+        # Long-lived outgoing connections keyed by (host, port), opened on first send
+        self._peer_socks = {}
 
         # TCP server socket
-        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server_socket.bind(('0.0.0.0', self.listen_port))
-        self.server_socket.listen(5)
-        # A timeout helps us periodically check if we're still running
-        self.server_socket.settimeout(1.0)
+        self.server_socket = None
+        if self.listen_port is not None:
+            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            # Lets a machine rebind its port while connections from a previous run sit in TIME_WAIT
+            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.server_socket.bind(('0.0.0.0', self.listen_port))
+            self.server_socket.listen(5)
+            # Non-blocking: the listener thread multiplexes it with the peer connections
+            self.server_socket.setblocking(False)
 
         # Control flag for shutting down gracefully
         self.running = True
+        # Set once running goes False; the log flusher waits on it rather than sleeping,
+        # so it wakes up as soon as the machine stops
+        self._stopped = threading.Event()
 
         startup_event = {
             "event": "STARTUP",
@@ -76,18 +106,29 @@ class Machine:
             "machine_id": self.machine_id,
             "clock_rate": self.clock_rate
         }
-        self.log_file.write(json.dumps(startup_event) + "\n")
+        self.log_event(startup_event)
 
     def start(self):
         """
         Starts the machine:
-          1. Launches a listener thread to accept incoming connections.
+          1. Launches a listener thread to accept and read incoming connections (if listening).
           2. Enters the main loop, running for `run_seconds`.
           3. Cleans up resources before exiting.
+        With `run_seconds <= 0` there is nothing to run, so it goes straight to step 3
+        (the STARTUP event was already logged in __init__; shutdown logs END).
         """
+        if self.run_seconds <= 0:
+            self.shutdown()
+            return
+
         # Start a separate thread to listen for incoming connections
-        listener_thread = threading.Thread(target=self.listen_for_connections, daemon=True)
-        listener_thread.start()
+        if self.server_socket is not None:
+            listener_thread = threading.Thread(target=self.listen_for_connections, daemon=True)
+            listener_thread.start()
+
+        # Periodically write out buffered log events so the log stays reasonably current
+        flusher_thread = threading.Thread(target=self.flush_log_periodically, daemon=True)
+        flusher_thread.start()
 
         # Enter the main loop
         self.main_loop()
@@ -95,45 +136,109 @@ class Machine:
         # Once done, shut down
         self.shutdown()
 
+    def log_event(self, event_data):
+        """
+        Encodes one event as a JSON line and appends it to the log buffer.
+        """
+        self.log_line(json.dumps(event_data) + "\n")
+
+    def log_line(self, line):
+        """
+        Appends one already-encoded JSON line to the log buffer.
+        The buffer is written out once LOG_FLUSH_EVENTS events are pending.
+        """
+        line = line.encode('utf-8')
+        with self._log_lock:
+            self._log_buf += line
+            self._log_pending += 1
+            if self._log_pending >= LOG_FLUSH_EVENTS:
+                self._write_log_buffer()
+
+    def flush_log(self):
+        """
+        Writes all buffered log events to the log file.
+        """
+        with self._log_lock:
+            self._write_log_buffer()
+
+    def _write_log_buffer(self):
+        # Caller must hold self._log_lock
+        if self._log_buf and not self.log_file.closed:
+            self.log_file.write(self._log_buf)
+            self.log_file.flush()
+        self._log_buf.clear()
+        self._log_pending = 0
+
+    def flush_log_periodically(self):
+        while not self._stopped.wait(LOG_FLUSH_INTERVAL):
+            self.flush_log()
+
     def listen_for_connections(self):
-        while self.running:
-            try:
-                conn, addr = self.server_socket.accept()
-                threading.Thread(
-                    target=self.handle_incoming_connection,
-                    args=(conn,),
-                    daemon=True
-                ).start()
-            except socket.timeout:
-                continue
-            except Exception as e:
+        """
+        Serves the server socket and every accepted connection from this one thread.
+        The short select timeout lets us periodically check if we're still running.
+        """
+        sel = selectors.DefaultSelector()
+        sel.register(self.server_socket, selectors.EVENT_READ)
+        try:
+            while self.running:
+                for key, _ in sel.select(timeout=0.1):
+                    if key.fileobj is self.server_socket:
+                        self.accept_connection(sel)
+                    else:
+                        self.read_connection(sel, key.fileobj, key.data)
+        except Exception as e:
+            if self.running:
                 print(f"[Machine {self.machine_id}] Socket error: {e}", file=sys.stderr)
-                break
+        finally:
+            for key in list(sel.get_map().values()):
+                if key.fileobj is not self.server_socket:
+                    key.fileobj.close()
+            sel.close()
 
-    def handle_incoming_connection(self, conn):
+    def accept_connection(self, sel):
+        """
+        Accepts a pending connection and registers it for reads,
+        with an empty buffer for any partial line.
         """
-        Receives data from a single connection, splits it by newline,
+        try:
+            conn, addr = self.server_socket.accept()
+        except BlockingIOError:
+            return
+        conn.setblocking(False)
+        sel.register(conn, selectors.EVENT_READ, bytearray())
+
+    def read_connection(self, sel, conn, pending):
+        """
+        Receives available data from a connection, splits it by newline,
         and enqueues each message as an integer (the sender's clock).
+        Peers keep their connection open, so a message may span two reads;
+        any trailing partial line is kept in `pending` until the rest arrives.
         """
         try:
-            with conn:
-                while self.running:
-                    data = conn.recv(1024)
-                    if not data:
-                        break
-                    lines = data.decode('utf-8').strip().split('\n')
-                    for line in lines:
-                        line = line.strip()
-                        if line:
-                            try:
-                                timestamp = int(line)
-                                self.incoming_queue.put(timestamp)
-                            except ValueError:
-                                # If the line isn't a valid integer, ignore or log an error
-                                pass
-        except Exception as e:
+            data = conn.recv(1024)
+        except BlockingIOError:
+            return
+        except OSError:
             # Connection might have been closed or reset
-            pass
+            data = b""
+        if not data:
+            sel.unregister(conn)
+            conn.close()
+            return
+
+        pending += data
+        *lines, rest = pending.split(b'\n')
+        pending[:] = rest
+        for line in lines:
+            line = line.strip()
+            if line:
+                try:
+                    timestamp = int(line)
+                    self.incoming_queue.put(timestamp)
+                except ValueError:
+                    # If the line isn't a valid integer, ignore or log an error
+                    pass
 
     def main_loop(self):
         """
@@ -155,6 +260,7 @@ class Machine:
 
         # Time's up
         self.running = False
+        self._stopped.set()
 
     def handle_receive(self):
         """
@@ -167,15 +273,11 @@ class Machine:
 
         queue_len = self.incoming_queue.qsize()
         sys_time = time.time()
-        event_data = {
-            "event": "RECEIVE",
-            "system_time": sys_time,
-            "machine_id": self.machine_id,
-            "old_clock": old_clock,
-            "new_clock": self.local_clock,
-            "queue_len": queue_len
-        }
-        self.log_file.write(json.dumps(event_data) + "\n")
+        # Same line json.dumps would produce for the event dict, without the per-call dict walk
+        self.log_line(
+            f'{{"event": "RECEIVE", "system_time": {sys_time!r}, "machine_id": {self._machine_id_json}, '
+            f'"old_clock": {old_clock}, "new_clock": {self.local_clock}, "queue_len": {queue_len}}}\n'
+        )
 
     def handle_no_message(self):
         """
@@ -185,7 +287,7 @@ class Machine:
           - 3 => send to both peers (if at least two exist)
           - else => internal event
         """
-        r = random.randint(1, 10)
+        r = self.draw_event_choice()
 
         if r == 1 and len(self.peer_addresses) > 0:
             self.send_message([self.peer_addresses[0]])
@@ -196,6 +298,17 @@ class Machine:
         else:
             self.internal_event()
 
+    def draw_event_choice(self):
+        """
+        Returns a random int in 1..10, taken from a batch of EVENT_DRAW_BATCH draws
+        so the tick loop doesn't pay for a random.randint call each time.
+        """
+        r = next(self._event_draws, None)
+        if r is None:
+            self._event_draws = iter(random.choices(range(1, 11), k=EVENT_DRAW_BATCH))
+            r = next(self._event_draws)
+        return r
+
     def send_message(self, recipients):
         """
         Sends this machine's local clock to each peer in `recipients`,
@@ -205,24 +318,60 @@ class Machine:
         self.local_clock += 1
         sys_time = time.time()
 
+        payload = f"{self.local_clock}\n".encode('utf-8')
         for (host, port) in recipients:
             try:
-                with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                    s.connect((host, port))
-                    s.sendall(f"{self.local_clock}\n".encode('utf-8'))
+                self.send_to_peer(host, port, payload)
             except Exception as e:
                 # If the peer is unreachable, we ignore or log the error
                 pass
 
-        event_data = {
-            "event": "SEND",
-            "system_time": sys_time,
-            "machine_id": self.machine_id,
-            "old_clock": old_clock,
-            "new_clock": self.local_clock,
-            "recipients": recipients
-        }
-        self.log_file.write(json.dumps(event_data) + "\n")
+        recipients_key = tuple(tuple(r) for r in recipients)
+        recipients_json = self._recipients_json.get(recipients_key)
+        if recipients_json is None:
+            recipients_json = self._recipients_json[recipients_key] = json.dumps(recipients)
+        self.log_line(
+            f'{{"event": "SEND", "system_time": {sys_time!r}, "machine_id": {self._machine_id_json}, '
+            f'"old_clock": {old_clock}, "new_clock": {self.local_clock}, "recipients": {recipients_json}}}\n'
+        )
+
+    def send_to_peer(self, host, port, payload):
+        """
+        Sends `payload` over the cached connection to (host, port).
+        If a cached connection has gone stale, reconnects once and retries;
+        a failed fresh connect is not retried, so a down peer costs one connect per send.
+        """
+        had_socket = (host, port) in self._peer_socks
+        try:
+            self.get_peer_socket(host, port).sendall(payload)
+        except OSError:
+            self.close_peer_socket(host, port)
+            if not had_socket:
+                raise
+            self.get_peer_socket(host, port).sendall(payload)
+
+    def get_peer_socket(self, host, port):
+        """
+        Returns the open connection to (host, port), connecting first if there is none.
+        """
+        sock = self._peer_socks.get((host, port))
+        if sock is None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            try:
+                sock.connect((host, port))
+            except OSError:
+                sock.close()
+                raise
+            self._peer_socks[(host, port)] = sock
+        return sock
+
+    def close_peer_socket(self, host, port):
+        sock = self._peer_socks.pop((host, port), None)
+        if sock is not None:
+            try:
+                sock.close()
+            except OSError:
+                pass
 
     def internal_event(self):
         """
@@ -232,14 +381,10 @@ class Machine:
         self.local_clock += 1
         sys_time = time.time()
 
-        event_data = {
-            "event": "INTERNAL",
-            "system_time": sys_time,
-            "machine_id": self.machine_id,
-            "old_clock": old_clock,
-            "new_clock": self.local_clock
-        }
-        self.log_file.write(json.dumps(event_data) + "\n")
+        self.log_line(
+            f'{{"event": "INTERNAL", "system_time": {sys_time!r}, "machine_id": {self._machine_id_json}, '
+            f'"old_clock": {old_clock}, "new_clock": {self.local_clock}}}\n'
+        )
 
     def shutdown(self):
         """
@@ -251,14 +396,20 @@ class Machine:
             "machine_id": self.machine_id,
             "final_clock": self.local_clock
         }
-        self.log_file.write(json.dumps(end_event) + "\n")
+        self.log_event(end_event)
         
         self.running = False
-        try:
-            self.server_socket.close()
-        except:
-            pass
-        self.log_file.close()
+        self._stopped.set()
+        if self.server_socket is not None:
+            try:
+                self.server_socket.close()
+            except:
+                pass
+        for (host, port) in list(self._peer_socks):
+            self.close_peer_socket(host, port)
+        with self._log_lock:
+            self._write_log_buffer()
+            self.log_file.close()
 
 def main():
     """
@@ -13,25 +13,28 @@ Usage:
 import argparse
 import multiprocessing
 import time
-import subprocess
 import os
+import signal
+import sys
 import datetime
 
+from machine import Machine
+
 def launch_machine(machine_id, port, peers, log_path, duration=60):
     """
-    Calls 'python machine.py' in a subprocess with the given arguments.
+    Runs a Machine with the given arguments in the calling process
+    (each one is started in its own multiprocessing.Process below).
     """
     peer_str = ",".join(f"{host}:{p}" for (host, p) in peers)
-    cmd = [
-        "python", "machine.py",
-        "--id", str(machine_id),
-        "--port", str(port),
-        "--peers", peer_str,
-        "--log", log_path,
-        "--duration", str(duration)
-    ]
-    print(f"Launching: {' '.join(cmd)}")
-    subprocess.run(cmd)
+    print(f"Launching: machine {machine_id} on port {port}, peers {peer_str}, log {log_path}, duration {duration}s")
+    machine = Machine(
+        machine_id=machine_id,
+        listen_port=port,
+        peer_addresses=peers,
+        log_filename=log_path,
+        run_seconds=duration
+    )
+    machine.start()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -80,11 +83,16 @@ if __name__ == "__main__":
         p.start()
         processes.append(p)
 
-    # Wait for them to finish (each runs for 60s by default)
-    time.sleep(70)
+    # If we are terminated ourselves, stop the machines too instead of orphaning them
+    # (installed after the fork, so the machines keep the default SIGTERM behaviour)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
 
-    # Optionally, terminate any that are still alive
-    for p in processes:
-        if p.is_alive():
-            p.terminate()
+    try:
+        # Wait for them to finish (each runs for 60s by default)
+        time.sleep(70)
+    finally:
+        # Optionally, terminate any that are still alive
+        for p in processes:
+            if p.is_alive():
+                p.terminate()
             p.join()
@@ -0,0 +1,21 @@
+# tests/conftest.py
+
+import os
+import pytest
+
+@pytest.fixture(scope="session", autouse=True)
+def warm_up_machine():
+    """
+    Builds and runs a throwaway Machine once per session, so the first real test
+    doesn't also pay for the first-use setup of the machine module and its sockets.
+    With run_seconds=0, start() returns immediately.
+    """
+    from machine import Machine
+    m = Machine(
+        machine_id=-1,
+        listen_port=0,
+        peer_addresses=[],
+        log_filename=os.devnull,
+        run_seconds=0
+    )
+    m.start()
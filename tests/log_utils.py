@@ -0,0 +1,40 @@
+# tests/log_utils.py
+
+import json
+from collections import defaultdict
+
+# orjson is optional; it decodes the short bytes records faster than json
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+def iter_log_lines(path, offset=0):
+    """
+    Yields the non-empty lines of the log file from byte `offset` on, as bytes without
+    their newline, reading the file through a 64 KiB buffer.
+    """
+    with open(path, 'rb', buffering=64 * 1024) as f:
+        f.seek(offset)
+        for ln in f:
+            ln = ln.strip()
+            if ln:
+                yield ln
+
+def iter_records(path, offset=0):
+    """
+    Yields each decoded record of the log file from byte `offset` on.
+    """
+    for ln in iter_log_lines(path, offset):
+        yield _json_loads(ln)
+
+def records_by_event(path, offset=0):
+    """
+    Returns a dict of event name -> list of records, from one pass over the log file
+    (from byte `offset` on). Every record is decoded once, however many assertions then look at it.
+    """
+    by_event = defaultdict(list)
+    for record in iter_records(path, offset):
+        by_event[record["event"]].append(record)
+    return by_event
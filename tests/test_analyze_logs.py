@@ -5,6 +5,10 @@ import os
 import subprocess
 import shutil
 import glob
+import json
+import numpy as np
+import pandas as pd
+import analyze_logs
 
 def test_analyze_logs_sample(tmp_path):
     """
@@ -46,3 +50,94 @@ def test_analyze_logs_sample(tmp_path):
         summary_content = f.read()
         assert "Summary Table" in summary_content, "Expected 'Summary Table' in analysis_summary.md"
         assert "Final Drift" in summary_content, "Expected 'Final Drift' in analysis_summary.md"
+
+def test_parse_json_log_file_skips_truncated_line(tmp_path):
+    """
+    A log cut short mid-write (e.g. a killed machine) makes pd.read_json give up;
+    the line-by-line fallback should then resume after the chunks already read
+    and still return every complete record. A blank line inside an early chunk
+    checks that resume point, since pandas drops blank lines without counting them.
+    """
+    with open(os.path.join("tests", "sample_logs", "machine_1.log"), "r") as f:
+        lines = f.read().splitlines()
+    lines.insert(5, "")
+    log_file = tmp_path / "machine_1.log"
+    log_file.write_text("\n".join(lines) + '\n{"event": "INTERNAL", "system_time": 17411')
+
+    expected = [json.loads(ln) for ln in lines if ln]
+    chunks = list(analyze_logs.iter_json_log_chunks(str(log_file), chunksize=50))
+    assert len(chunks) > 1, "Expected both the pandas reader and the fallback to yield chunks"
+    df = pd.concat(chunks, ignore_index=True)
+    assert len(df) == len(expected)
+    assert df['system_time'].tolist() == [r['system_time'] for r in expected]
+
+    df = analyze_logs.parse_json_log_file(str(log_file))
+    assert len(df) == len(expected)
+
+def test_load_combined_log_cache(tmp_path, monkeypatch):
+    """
+    A second load of unchanged logs should be served from the Parquet cache,
+    and touching one of the logs should make the next load rebuild it.
+    """
+    if analyze_logs._PARQUET_ENGINE is None:
+        pytest.skip("no Parquet engine installed, so nothing is cached")
+
+    log_files = []
+    for fname in ["machine_1.log", "machine_2.log", "machine_3.log"]:
+        dst = os.path.join(tmp_path, fname)
+        shutil.copyfile(os.path.join("tests", "sample_logs", fname), dst)
+        log_files.append(dst)
+
+    combine_calls = []
+    combine_log_files = analyze_logs.combine_log_files
+    def counting_combine(files):
+        combine_calls.append(files)
+        return combine_log_files(files)
+    monkeypatch.setattr(analyze_logs, "combine_log_files", counting_combine)
+
+    first = analyze_logs.load_combined_log(log_files, str(tmp_path))
+    assert len(combine_calls) == 1
+    assert os.path.exists(tmp_path / analyze_logs.COMBINED_CACHE_FILE)
+    assert os.path.exists(tmp_path / analyze_logs.COMBINED_META_FILE)
+
+    second = analyze_logs.load_combined_log(log_files, str(tmp_path))
+    assert len(combine_calls) == 1, "Unchanged logs should be read from the cache"
+    pd.testing.assert_frame_equal(first, second)
+
+    st = os.stat(log_files[1])
+    os.utime(log_files[1], ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+    analyze_logs.load_combined_log(log_files, str(tmp_path))
+    assert len(combine_calls) == 2, "Touching a log should invalidate the cache"
+
+def test_summarize_machines_kernel_matches_groupby(monkeypatch):
+    """
+    The per-machine summary kernel (used when numba is installed) should give the
+    same result as the pandas groupby path. The kernel runs as plain Python here.
+    """
+    log_files = sorted(glob.glob(os.path.join("tests", "sample_logs", "machine_*.log")))
+    data = analyze_logs.combine_log_files(log_files)
+    data['clock_jump'] = data['new_clock'].to_numpy() - data['old_clock'].to_numpy()
+    data['is_recv'] = data['event'].to_numpy() == 'RECEIVE'
+
+    monkeypatch.setattr(analyze_logs, "_HAVE_NUMBA", False)
+    expected = analyze_logs.aggregate_per_machine(data)
+
+    kernel = getattr(analyze_logs._summarize_machines, "py_func", analyze_logs._summarize_machines)
+    monkeypatch.setattr(analyze_logs, "_HAVE_NUMBA", True)
+    monkeypatch.setattr(analyze_logs, "_summarize_machines", kernel)
+    result = analyze_logs.aggregate_per_machine(data)
+
+    pd.testing.assert_frame_equal(result, expected)
+
+def test_least_crowded_corner_avoids_traces():
+    """
+    A rising trace fills the lower-left and upper-right corners,
+    so the legend should go to the upper left.
+    """
+    fig, ax = analyze_logs.plt.subplots()
+    ax.set_xlim(0, 100)
+    ax.set_ylim(0, 100)
+    x = np.arange(101.0)
+    assert analyze_logs.least_crowded_corner(ax, [np.column_stack([x, x])]) == 'upper left'
+    assert analyze_logs.least_crowded_corner(ax, [np.column_stack([x, 100 - x])]) == 'upper right'
+    analyze_logs.plt.close(fig)
@@ -1,38 +1,100 @@
 # tests/test_integration.py
 
-import pytest
 import subprocess
+import signal
 import time
 import os
-import glob
+import sys
+from tests.log_utils import iter_records
+
+def log_has_startup(path):
+    """
+    Returns True if the machine log at `path` contains a STARTUP event.
+    A line caught mid-write doesn't decode yet; that log is simply checked again on the next poll.
+    """
+    try:
+        return any(record["event"] == "STARTUP" for record in iter_records(path))
+    except ValueError:
+        return False
+
+def find_first_startup(root):
+    """
+    Walks `root` with os.scandir and returns the first machine_*.log containing
+    a STARTUP event, or None. Stops at the first hit without listing the rest of the tree.
+    """
+    stack = [str(root)]
+    while stack:
+        d = stack.pop()
+        try:
+            it = os.scandir(d)
+        except FileNotFoundError:
+            continue
+        with it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.startswith("machine_") and entry.name.endswith(".log"):
+                    if log_has_startup(entry.path):
+                        return entry.path
+    return None
+
+def wait_for_startup(logs_root, timeout=10.0):
+    """
+    Polls `logs_root` for a machine_*.log containing a STARTUP event,
+    backing off from 20ms to 250ms between scans.
+    Returns the first such log path, or None if none appears within `timeout` seconds.
+    """
+    deadline = time.monotonic() + timeout
+    delay = 0.02
+    while time.monotonic() < deadline:
+        path = find_first_startup(logs_root)
+        if path is not None:
+            return path
+        time.sleep(delay)
+        delay = min(delay * 2, 0.25)
+    return None
+
+def stop_process_group(proc, timeout=5.0):
+    """
+    Stops `proc` (started with start_new_session=True) and the machine processes it spawned.
+    SIGTERM goes to the whole process group; run_machine.py then joins its machines before
+    exiting, so once `proc` has exited their fixed ports are free again. Anything still
+    running after `timeout` seconds is killed.
+    """
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)
+        proc.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        os.killpg(proc.pid, signal.SIGKILL)
+        proc.wait()
+    except ProcessLookupError:
+        proc.wait()
 
 def test_run_machine_local(tmp_path):
     """
     Launch multiple machines locally (via run_machine.py),
-    wait, then check logs for a STARTUP event.
+    wait for one to log its STARTUP event, then check the logs.
     """
     logs_dir = tmp_path / "logs_run"
+    # -S skips site initialization; run_machine.py and machine.py only need the stdlib.
+    # (-I can't be used: isolated mode drops the script's directory from sys.path,
+    # which run_machine.py needs to import machine.)
     cmd = [
-        "python", "run_machine.py",
+        sys.executable, "-S", "run_machine.py",
         "--logs_dir", str(logs_dir),
-        "--duration", "5"
+        "--duration", "2"
     ]
-    proc = subprocess.Popen(cmd)
-    # Wait ~10s for them to produce logs (they run 60s by default)
-    time.sleep(10)
-    proc.terminate()
-    proc.wait()
-
-    # Glob logs: run_machine.py should create logs/run_<timestamp>/machine_*.log
-    log_files = list(glob.glob(os.path.join("logs", "**", "machine_*.log"), recursive=True))
-    assert len(log_files) > 0, "Should produce at least one machine log"
-
-    found_startup = False
-    for lf in log_files:
-        with open(lf, "r") as f:
-            content = f.read()
-            if '"event": "STARTUP"' in content:
-                found_startup = True
-                break
-
-    assert found_startup, "No STARTUP event found in any machine log"
+    # Discard output so a full pipe buffer can never stall the launcher.
+    # A new session puts the launcher and its machine processes in one process group,
+    # so they can all be stopped together.
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+    # Return as soon as a machine has logged its startup, rather than after a fixed sleep
+    try:
+        first_log = wait_for_startup(logs_dir)
+    finally:
+        stop_process_group(proc)
+
+    assert first_log is not None, "No STARTUP event found in any machine log"
+
+    # run_machine.py writes machine_*.log directly into --logs_dir
+    assert os.path.dirname(first_log) == str(logs_dir)
@@ -3,18 +3,43 @@
 import pytest
 import json
 import socket
+import os
 import time
+import itertools
 from machine import Machine
-from unittest.mock import patch
+from tests.log_utils import iter_log_lines, records_by_event
+from unittest.mock import MagicMock, patch
+
+def free_port():
+    """Return a random free TCP port."""
+    # SOCK_CLOEXEC is Linux-only (and Python already creates sockets non-inheritable)
+    sock_type = socket.SOCK_STREAM | getattr(socket, "SOCK_CLOEXEC", 0)
+    with socket.socket(socket.AF_INET, sock_type) as s:
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
 
 @pytest.fixture
 def ephemeral_port():
-    """Return a random free TCP port."""
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    s.bind(('0.0.0.0', 0))
-    port = s.getsockname()[1]
-    s.close()
-    return port
+    return free_port()
+
+@pytest.fixture(scope="module")
+def shared_machine(tmp_path_factory):
+    """
+    One Machine shared by the event-unit tests, which only call its event handlers.
+    It never does network input, so it opens no listening port; and it is never
+    start()ed, so tests assert on what each event appended to the log.
+    """
+    log_file = tmp_path_factory.mktemp("shared_machine") / "test_machine.log"
+    m = Machine(
+        machine_id=0,
+        listen_port=None,
+        peer_addresses=[],
+        log_filename=str(log_file),
+        run_seconds=0
+    )
+    yield m
+    m.shutdown()
 
 def test_machine_startup_logging(tmp_path, ephemeral_port):
     """
@@ -26,106 +51,109 @@ def test_machine_startup_logging(tmp_path, ephemeral_port):
         listen_port=ephemeral_port,
         peer_addresses=[],
         log_filename=str(log_file),
-        run_seconds=1
+        run_seconds=0
     )
-    m.start()  # runs for ~1s
+    m.start()  # returns immediately
 
-    with open(log_file, 'r') as f:
-        lines = f.read().strip().splitlines()
-
-    startup_lines = [ln for ln in lines if '"event": "STARTUP"' in ln]
-    assert len(startup_lines) == 1, "Expected exactly one STARTUP event"
-    record = json.loads(startup_lines[0])
+    by_event = records_by_event(log_file)
+    assert len(by_event["STARTUP"]) == 1, "Expected exactly one STARTUP event"
+    record = by_event["STARTUP"][0]
     assert "clock_rate" in record
     assert 1 <= record["clock_rate"] <= 6
 
-def test_machine_internal_event(tmp_path, ephemeral_port):
+@pytest.mark.parametrize("event", ["INTERNAL", "RECEIVE", "SEND"])
+@patch("machine.socket.socket")
+def test_machine_event(mock_socket, shared_machine, event):
     """
-    Calls internal_event() directly and checks for the INTERNAL log line.
+    Triggers one INTERNAL, RECEIVE or SEND event on the shared Machine and checks
+    the clock update and that exactly one line, of that event, was appended to the log.
+    The socket layer is mocked so SEND doesn't really connect.
     """
-    log_file = tmp_path / "test_machine.log"
-    m = Machine(
-        machine_id=2,
-        listen_port=ephemeral_port,
-        peer_addresses=[],
-        log_filename=str(log_file),
-        run_seconds=1
-    )
-
+    m = shared_machine
+    m.flush_log()
+    offset = os.path.getsize(m.log_filename)
     old_clock = m.local_clock
-    m.internal_event()
-    assert m.local_clock == old_clock + 1, "internal_event should increment clock by 1"
 
-    with open(log_file, 'r') as f:
-        content = f.read().strip().splitlines()
-    internal_lines = [ln for ln in content if '"event": "INTERNAL"' in ln]
-    assert len(internal_lines) == 1, "Should log exactly one INTERNAL event"
+    if event == "INTERNAL":
+        m.internal_event()
+        assert m.local_clock == old_clock + 1, "internal_event should increment clock by 1"
+    elif event == "RECEIVE":
+        msg_timestamp = old_clock + 10
+        m.incoming_queue.put(msg_timestamp)
+        m.handle_receive()
+        assert m.local_clock == max(old_clock, msg_timestamp) + 1
+    else:
+        m.send_message([("localhost", 5002)])
+        assert m.local_clock == old_clock + 1
+
+    m.flush_log()
+    by_event = records_by_event(m.log_filename, offset)
+    assert {e: len(r) for e, r in by_event.items()} == {event: 1}, f"Should log exactly one {event} event"
+    if event == "SEND":
+        assert by_event["SEND"][0]["recipients"] == [["localhost", 5002]]
 
-def test_machine_receive_event(tmp_path, ephemeral_port):
+def test_machine_end_event(tmp_path, ephemeral_port):
     """
-    Test handle_receive() by manually enqueueing a message, then calling handle_receive().
+    When the machine stops, it should log an END event with final_clock.
+    The 1s run goes through the real tick loop, but time.sleep is a no-op and
+    time.time is a fake clock advancing 50ms per call, so it finishes instantly.
     """
     log_file = tmp_path / "test_machine.log"
     m = Machine(
-        machine_id=3,
+        machine_id=5,
         listen_port=ephemeral_port,
         peer_addresses=[],
         log_filename=str(log_file),
         run_seconds=1
     )
+    fake_clock = itertools.count(time.time(), 0.05)
+    with patch("machine.time.sleep", lambda *_: None), patch("machine.time.time", side_effect=fake_clock):
+        m.start()
+
+    by_event = records_by_event(log_file)
+    assert len(by_event["END"]) == 1, "Should log exactly one END event"
+    assert len(by_event["INTERNAL"]) > 0, "The tick loop should have run"
+    record = by_event["END"][0]
+    assert "final_clock" in record
+    # With no peers every tick is an INTERNAL event, each advancing the clock by 1
+    assert record["final_clock"] == by_event["INTERNAL"][-1]["new_clock"] == len(by_event["INTERNAL"])
 
+@patch("machine.socket.socket")
+def test_machine_event_lines_match_json_dumps(mock_socket, shared_machine):
+    """
+    The hand-written RECEIVE/SEND/INTERNAL lines should be byte-identical to json.dumps of the event.
+    """
+    m = shared_machine
+    m.internal_event()
     m.incoming_queue.put(10)
-    old_clock = m.local_clock
     m.handle_receive()
-    assert m.local_clock == max(old_clock, 10) + 1
+    m.send_message([("localhost", 5002), ("localhost", 5003)])
+    m.flush_log()
 
-    with open(log_file, 'r') as f:
-        content = f.read().strip().splitlines()
-    recv_lines = [ln for ln in content if '"event": "RECEIVE"' in ln]
-    assert len(recv_lines) == 1, "Should log exactly one RECEIVE event"
+    checked = 0
+    for checked, ln in enumerate(iter_log_lines(m.log_filename), 1):
+        assert ln == json.dumps(json.loads(ln)).encode('utf-8')
+    assert checked >= 4
 
 @patch("machine.socket.socket")
-def test_machine_send_event(mock_socket, tmp_path, ephemeral_port):
+def test_send_to_peer_retries_only_stale_connections(mock_socket, shared_machine):
     """
-    Test send_message() by mocking the socket layer so we don't really connect.
+    A stale cached connection is reconnected and the send retried once;
+    a peer that refuses a fresh connection is tried only once per send.
     """
-    log_file = tmp_path / "test_machine.log"
-    m = Machine(
-        machine_id=4,
-        listen_port=ephemeral_port,
-        peer_addresses=[],
-        log_filename=str(log_file),
-        run_seconds=1
-    )
-
-    old_clock = m.local_clock
+    m = shared_machine
+    for host, port in list(m._peer_socks):
+        m.close_peer_socket(host, port)
+    stale = MagicMock()
+    stale.sendall.side_effect = BrokenPipeError
+    m._peer_socks[("localhost", 5002)] = stale
     m.send_message([("localhost", 5002)])
-    assert m.local_clock == old_clock + 1
-
-    with open(log_file, 'r') as f:
-        content = f.read().strip().splitlines()
-    send_lines = [ln for ln in content if '"event": "SEND"' in ln]
-    assert len(send_lines) == 1, "Should log exactly one SEND event"
-    record = json.loads(send_lines[0])
-    assert record["recipients"] == [["localhost", 5002]]
-
-def test_machine_end_event(tmp_path, ephemeral_port):
-    """
-    When the machine stops, it should log an END event with final_clock.
-    """
-    log_file = tmp_path / "test_machine.log"
-    m = Machine(
-        machine_id=5,
-        listen_port=ephemeral_port,
-        peer_addresses=[],
-        log_filename=str(log_file),
-        run_seconds=1
-    )
-    m.start()  # ~1s
-
-    with open(log_file, 'r') as f:
-        lines = f.read().strip().splitlines()
-    end_lines = [ln for ln in lines if '"event": "END"' in ln]
-    assert len(end_lines) == 1, "Should log exactly one END event"
-    record = json.loads(end_lines[0])
-    assert "final_clock" in record
+    stale.close.assert_called_once()
+    mock_socket.return_value.sendall.assert_called_once()
+    m.close_peer_socket("localhost", 5002)
+
+    mock_socket.reset_mock()
+    mock_socket.return_value.connect.side_effect = ConnectionRefusedError
+    m.send_message([("localhost", 5003)])
+    assert mock_socket.return_value.connect.call_count == 1
+    assert ("localhost", 5003) not in m._peer_socks